@@ -0,0 +1,103 @@
+"""
+Pre-tokenized chat prompts for the ML service.
+
+Each endpoint's prompt is rendered through the chat template once at load
+time and cut into segments. Segments without per-request fields are
+tokenized once and kept as token-ID tensors; only the lines carrying
+per-request fields are tokenized for each request and spliced in between.
+"""
+
+import re
+import torch
+
+# Cut points: start of a line that begins with a non-whitespace character.
+# The Qwen2 pre-tokenizer never merges a newline with the character that
+# follows it, so tokenizing the pieces separately yields the same IDs as
+# tokenizing the whole text.
+LINE_BOUNDARY = re.compile(r"(?<=\n)(?=\S)")
+
+SENTINEL = "\x00{}\x00"
+
+
+def build_messages(system_prompt, prompt):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def render_chat(tokenizer, system_prompt, prompt):
+    """Reference path: full chat templating followed by tokenization."""
+    text = tokenizer.apply_chat_template(
+        build_messages(system_prompt, prompt),
+        tokenize=False,
+        add_generation_prompt=True
+    )
+    return tokenizer([text], return_tensors="pt")
+
+
+class PromptTemplate:
+    """A chat prompt compiled into fixed token IDs plus per-request field lines."""
+
+    def __init__(self, tokenizer, system_prompt, prompt, fields):
+        self.tokenizer = tokenizer
+        self.system_prompt = system_prompt
+        self.prompt = prompt
+        self.fields = fields
+
+        # Render once with sentinels in place of the fields
+        sentinels = {name: SENTINEL.format(name) for name in fields}
+        rendered = tokenizer.apply_chat_template(
+            build_messages(system_prompt, prompt.format(**sentinels)),
+            tokenize=False,
+            add_generation_prompt=True
+        )
+
+        # Group lines into static runs and dynamic runs (lines with a field)
+        groups = []
+        for piece in LINE_BOUNDARY.split(rendered):
+            is_dynamic = any(s in piece for s in sentinels.values())
+            if groups and groups[-1][0] == is_dynamic:
+                groups[-1][1] += piece
+            else:
+                groups.append([is_dynamic, piece])
+
+        # Each segment is either a token-ID tensor or a str.format pattern
+        self.segments = []
+        for is_dynamic, text in groups:
+            if is_dynamic:
+                pattern = text.replace("{", "{{").replace("}", "}}")
+                for name, sentinel in sentinels.items():
+                    pattern = pattern.replace(sentinel, "{" + name + "}")
+                self.segments.append(pattern)
+            else:
+                self.segments.append(self._tokenize(text))
+
+    def _tokenize(self, text):
+        ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+        return torch.tensor(ids, dtype=torch.long)
+
+    def encode(self, **values):
+        """Build model inputs for one request, matching render_chat token for token."""
+        parts = [
+            self._tokenize(segment.format(**values)) if isinstance(segment, str) else segment
+            for segment in self.segments
+        ]
+        input_ids = torch.cat(parts).unsqueeze(0)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids)
+        }
+
+    def reference(self, **values):
+        return render_chat(self.tokenizer, self.system_prompt, self.prompt.format(**values))
+
+    def verify(self, samples):
+        """Check spliced IDs against the full templating path. Returns a list of mismatched samples."""
+        mismatches = []
+        for values in samples:
+            expected = self.reference(**values)["input_ids"]
+            actual = self.encode(**values)["input_ids"]
+            if not torch.equal(expected, actual):
+                mismatches.append(values)
+        return mismatches
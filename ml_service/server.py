@@ -8,6 +8,7 @@ import time
 import asyncio
 import os
 from contextlib import asynccontextmanager
+from prompt_templates import PromptTemplate, render_chat
 
 # Enable offline mode to use cached model
 os.environ["HF_HUB_OFFLINE"] = "1"
@@ -20,9 +21,108 @@ model_load_time = 0
 server_start_time = 0
 last_request_time = 0
 MODEL_NAME = "Qwen/Qwen2.5-1.5B-Instruct"
+prompt_templates = {} # endpoint -> PromptTemplate, compiled at load
+
+SYSTEM_PROMPT = "You are a helpful assistant that outputs only valid JSON."
+
+COOKIE_PROMPT = """You are an advanced Browser Security Architect. Analyze this website cookie for privacy risk and security purpose.
+
+Cookie Details:
+- Name: {name}
+- Domain: {domain}
+- Type: {expiry}
+- Secure: {secure}
+- HttpOnly: {httpOnly}
+
+Intent Hierarchy (Choose one):
+1. Authentication (Login state, Session ID) -> CRITICAL
+2. Security (CSRF, Fraud prevention, WAF) -> CRITICAL
+3. Preference (Language, Theme, Settings)
+4. Analytics (Usage stats, Performance)
+5. Advertising (Targeting, Personalization)
+6. Tracking (Cross-site profiling, Fingerprinting)
+7. Unknown (Unclear purpose)
+
+Safety Rules:
+- If likely Authentication or Security, risk_score MUST be <= 30 and auto_block_allowed MUST be false.
+- If Advertising/Tracking and Persistent, risk_score should be > 50.
+
+Response Format (JSON Only):
+{{
+  "category": "Essential|Functional|Analytics|Advertising|Tracking|Unknown",
+  "cookie_intent": "Authentication|Security|Preference|Analytics|Advertising|Tracking|Unknown",
+  "risk_score": <0-100 integer>,
+  "confidence_level": "high|medium|low",
+  "auto_block_allowed": <true|false>,
+  "explanation": "String (1 sentence, clear and user-friendly. Explain WHAT it does and WHY it is safe/risky.)"
+}}
+"""
+
+TERMS_PROMPT = """You are a privacy and consumer-rights expert.
+
+Analyze the following legal text from a website’s Terms & Conditions or Privacy Policy.
+
+Tasks:
+1. Identify clauses related to:
+   - Data collection
+   - Data sharing with third parties
+   - Advertising or tracking
+   - User consent
+   - Account suspension or termination
+   - Legal liability limitations
+2. Flag any potentially harmful, vague, or user-unfriendly clauses.
+3. Assign a risk score (0–100) for this chunk.
+4. Explain the risk in simple, non-legal language.
+
+Text to Analyze:
+"{text}"
+
+Respond in strict JSON format only:
+{{
+  "identified_clauses": ["List of identified topics found in text"],
+  "risk_flags": ["List of specific risks found"],
+  "risk_score": <int 0-100>,
+  "explanation": "One sentence summary of the risk."
+}}
+"""
+
+PROMPTS = {
+    "cookie": (COOKIE_PROMPT, ["name", "domain", "expiry", "secure", "httpOnly"]),
+    "terms": (TERMS_PROMPT, ["text"]),
+}
+
+# Field values checked against the full templating path after compiling
+VERIFY_SAMPLES = {
+    "cookie": [
+        {"name": "sessionid", "domain": "bank.com", "expiry": "Session", "secure": True, "httpOnly": True},
+        {"name": "wp_sec_", "domain": ".wordpress.com", "expiry": "Persistent", "secure": False, "httpOnly": False},
+        {"name": "__Secure-next-auth.session-token", "domain": "", "expiry": "Session", "secure": True, "httpOnly": False},
+    ],
+    "terms": [
+        {"text": "We may share your data with third parties."},
+        {"text": " \"Quoted\" clause:\n\n- item one\n- item two \n"},
+        {"text": ""},
+    ],
+}
+
+def compile_prompt_templates(tokenizer_obj):
+    """Pre-tokenize each endpoint's chat prompt, keeping only those that match the full path."""
+    compiled = {}
+    for name, (prompt, fields) in PROMPTS.items():
+        try:
+            template = PromptTemplate(tokenizer_obj, SYSTEM_PROMPT, prompt, fields)
+            mismatches = template.verify(VERIFY_SAMPLES[name])
+        except Exception as e:
+            print(f"Prompt template '{name}' failed to compile: {e}")
+            continue
+        if mismatches:
+            print(f"Prompt template '{name}' differs from full templating for {mismatches}, using full path.")
+            continue
+        compiled[name] = template
+    return compiled
 
 def load_model_sync():
-    global model, tokenizer, model_status, model_load_time
+    global model, tokenizer, prompt_templates, model_status, model_load_time
     print(f"Loading {MODEL_NAME} (offline mode)...")
     try:
         start_time = time.time()
@@ -37,9 +137,13 @@ def load_model_sync():
         )
         model_load_time = time.time() - start_time
         print(f"Model loaded successfully in {model_load_time:.2f}s.")
+
+        templates = compile_prompt_templates(tokenizer_obj)
+        print(f"Pre-tokenized prompt templates: {sorted(templates) or 'none'}")
         
         # Update globals safely
         tokenizer = tokenizer_obj
+        prompt_templates = templates
         model = model_obj
         model_status = "ready"
     except Exception as e:
@@ -138,47 +242,19 @@ async def analyze_cookie(cookie: CookieData):
         model_status = "busy"
 
     try:
-        # Construct Prompt with Intent Hierarchy
-        expiry_text = "Session" if cookie.session else "Persistent"
-        
-        prompt = f"""You are an advanced Browser Security Architect. Analyze this website cookie for privacy risk and security purpose.
-
-Cookie Details:
-- Name: {cookie.name}
-- Domain: {cookie.domain}
-- Type: {expiry_text}
-- Secure: {cookie.secure}
-- HttpOnly: {cookie.httpOnly}
-
-Intent Hierarchy (Choose one):
-1. Authentication (Login state, Session ID) -> CRITICAL
-2. Security (CSRF, Fraud prevention, WAF) -> CRITICAL
-3. Preference (Language, Theme, Settings)
-4. Analytics (Usage stats, Performance)
-5. Advertising (Targeting, Personalization)
-6. Tracking (Cross-site profiling, Fingerprinting)
-7. Unknown (Unclear purpose)
-
-Safety Rules:
-- If likely Authentication or Security, risk_score MUST be <= 30 and auto_block_allowed MUST be false.
-- If Advertising/Tracking and Persistent, risk_score should be > 50.
-
-Response Format (JSON Only):
-{{
-  "category": "Essential|Functional|Analytics|Advertising|Tracking|Unknown",
-  "cookie_intent": "Authentication|Security|Preference|Analytics|Advertising|Tracking|Unknown",
-  "risk_score": <0-100 integer>,
-  "confidence_level": "high|medium|low",
-  "auto_block_allowed": <true|false>,
-  "explanation": "String (1 sentence, clear and user-friendly. Explain WHAT it does and WHY it is safe/risky.)"
-}}
-"""
+        fields = {
+            "name": cookie.name,
+            "domain": cookie.domain,
+            "expiry": "Session" if cookie.session else "Persistent",
+            "secure": cookie.secure,
+            "httpOnly": cookie.httpOnly,
+        }
         
         # Serialize inference with a Lock to prevent MPS thread double-free
         async with inference_lock:
              # Run generation in executor to avoid blocking event loop
              loop = asyncio.get_running_loop()
-             result = await loop.run_in_executor(None, generate_response, prompt, cookie)
+             result = await loop.run_in_executor(None, generate_response, "cookie", fields, cookie)
              return result
 
     finally:
@@ -208,55 +284,23 @@ async def analyze_terms(chunk: TermsChunk):
         model_status = "busy"
 
     try:
-        prompt = f"""You are a privacy and consumer-rights expert.
-
-Analyze the following legal text from a website’s Terms & Conditions or Privacy Policy.
-
-Tasks:
-1. Identify clauses related to:
-   - Data collection
-   - Data sharing with third parties
-   - Advertising or tracking
-   - User consent
-   - Account suspension or termination
-   - Legal liability limitations
-2. Flag any potentially harmful, vague, or user-unfriendly clauses.
-3. Assign a risk score (0–100) for this chunk.
-4. Explain the risk in simple, non-legal language.
-
-Text to Analyze:
-"{chunk.text}"
-
-Respond in strict JSON format only:
-{{
-  "identified_clauses": ["List of identified topics found in text"],
-  "risk_flags": ["List of specific risks found"],
-  "risk_score": <int 0-100>,
-  "explanation": "One sentence summary of the risk."
-}}
-"""
         # Serialize inference with a Lock
         async with inference_lock:
              loop = asyncio.get_running_loop()
-             return await loop.run_in_executor(None, generate_response, prompt, None)
+             return await loop.run_in_executor(None, generate_response, "terms", {"text": chunk.text}, None)
         
     finally:
         model_status = "ready"
 
-def generate_response(prompt, cookie=None):
+def generate_response(prompt_name, fields, cookie=None):
     try:
-        messages = [
-            {"role": "system", "content": "You are a helpful assistant that outputs only valid JSON."},
-            {"role": "user", "content": prompt}
-        ]
-        
-        text = tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        
-        model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+        template = prompt_templates.get(prompt_name)
+        if template:
+            model_inputs = template.encode(**fields)
+        else:
+            prompt, _ = PROMPTS[prompt_name]
+            model_inputs = render_chat(tokenizer, SYSTEM_PROMPT, prompt.format(**fields))
+        model_inputs = {key: value.to(model.device) for key, value in model_inputs.items()}
 
         generated_ids = model.generate(
             **model_inputs,
@@ -266,7 +310,7 @@ def generate_response(prompt, cookie=None):
         )
         
         generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
+            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs["input_ids"], generated_ids)
         ]
         
         response_text = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]